@@ -1,61 +1,185 @@
+import functools
 import logging
-import json
-from typing import List, Optional, Union
+import struct
+from typing import List, Optional, Tuple, Union
+
+import orjson
+
+# Bit masks for the 8 winning lines, where bit i is square i (row-major)
+LINES = (
+    0o007, 0o070, 0o700,  # Rows
+    0o111, 0o222, 0o444,  # Columns
+    0o421, 0o124  # Diagonals
+)
+
+# Mask with all 9 squares set
+FULL_MASK = 0o777
+
+# Stored layout of the 9 boards: an (x_bits, o_bits) pair of little-endian
+# uint16 per board, 36 bytes in all
+BOARDS_STRUCT = struct.Struct("<18H")
+# One board's (x_bits, o_bits) pair within that layout
+BOARD_STRUCT = struct.Struct("<2H")
+
+# Bit for each position, in order, and keyed by position; a failed lookup in
+# SQUARE_BITS doubles as the bounds check
+BITS = tuple(1 << pos for pos in range(9))
+SQUARE_BITS = dict(enumerate(BITS))
+
+def _pack(squares: List[str]) -> Tuple[int, int]:
+    """Pack a list representation into (x_bits, o_bits) bitboards."""
+    x_bits = o_bits = 0
+    for value, bit in zip(squares, BITS):
+        if value == "X":
+            x_bits |= bit
+        elif value == "O":
+            o_bits |= bit
+    return x_bits, o_bits
+
+# Square values for one row of 3, indexed by the row's X bits | O bits << 3.
+# Decoding a board takes three lookups of the interned strings rather than a
+# comparison per square.
+ROW_SQUARES = tuple(
+    tuple("X" if code >> i & 1 else "O" if code >> 3 + i & 1 else "" for i in range(3))
+    for code in range(64)
+)
+
+# WINS[bits] is True when the 9-bit occupancy pattern covers a winning line.
+# X and O share the table since a line is a line regardless of the player.
+WINS = tuple(
+    any(bits & mask == mask for mask in LINES) for bits in range(FULL_MASK + 1)
+)
+
+# Sized to hold every reachable board (3^9), so a position is decoded at most
+# once and repeated responses share the same tuple.
+@functools.lru_cache(maxsize=3 ** 9)
+def _squares_from_bits(x_bits: int, o_bits: int) -> Tuple[str, ...]:
+    """Decode a bitboard pair into a tuple of 'X', 'O' and '' squares."""
+    return (
+        ROW_SQUARES[x_bits & 7 | (o_bits & 7) << 3]
+        + ROW_SQUARES[x_bits >> 3 & 7 | (o_bits >> 3 & 7) << 3]
+        + ROW_SQUARES[x_bits >> 6 | o_bits >> 6 << 3]
+    )
+
+def _winner_from_bits(x_bits: int, o_bits: int) -> Optional[str]:
+    """Return 'X' or 'O' if either bitboard covers a winning line."""
+    if WINS[x_bits]:
+        return "X"
+    if WINS[o_bits]:
+        return "O"
+    return None
+
+# Kept for callers that only hold the list form of a board; Board and
+# MetaBoard look winners up from their bitboards and don't go through here
+@functools.lru_cache(maxsize=8192)
+def _winner_from_squares(squares: Tuple[str, ...]) -> Optional[str]:
+    """Memoized winner check for a tuple of squares."""
+    return _winner_from_bits(*_pack(squares))
 
 class Board:
-    """Board logic for a single tic-tac-toe board."""
+    """Board logic for a single tic-tac-toe board.
+
+    The squares are stored as two 9-bit bitboards, one per player.
+    """
+    
+    __slots__ = ("x_bits", "o_bits")
     
     def __init__(self, squares: List[str] = None):
-        self._squares = squares if squares else ["" for _ in range(9)]
+        self.x_bits, self.o_bits = _pack(squares) if squares else (0, 0)
+    
+    @classmethod
+    def from_bits(cls, x_bits: int, o_bits: int) -> "Board":
+        """Create a board directly from its bitboards."""
+        board = cls.__new__(cls)
+        board.x_bits = x_bits
+        board.o_bits = o_bits
+        return board
     
     def get(self, pos: int) -> str:
         """Get the value at position."""
-        if not 0 <= pos <= 8:
-            raise ValueError("Position must be between 0 and 8")
-        return self._squares[pos]
+        try:
+            bit = SQUARE_BITS[pos]
+        except KeyError:
+            raise ValueError("Position must be between 0 and 8") from None
+        if self.x_bits & bit:
+            return "X"
+        if self.o_bits & bit:
+            return "O"
+        return ""
+    
+    def is_empty(self, pos: int) -> bool:
+        """Check if position is free, without decoding it to a string."""
+        try:
+            bit = SQUARE_BITS[pos]
+        except KeyError:
+            raise ValueError("Position must be between 0 and 8") from None
+        return not (self.x_bits | self.o_bits) & bit
     
     def set(self, pos: int, value: str) -> None:
         """Set a value at position."""
-        if not 0 <= pos <= 8:
-            raise ValueError("Position must be between 0 and 8")
-        if value not in ["", "X", "O"]:
+        try:
+            bit = SQUARE_BITS[pos]
+        except KeyError:
+            raise ValueError("Position must be between 0 and 8") from None
+        if value == "X":
+            self.x_bits |= bit
+            self.o_bits &= ~bit
+        elif value == "O":
+            self.o_bits |= bit
+            self.x_bits &= ~bit
+        elif value == "":
+            self.x_bits &= ~bit
+            self.o_bits &= ~bit
+        else:
             raise ValueError("Value must be '', 'X', or 'O'")
-        self._squares[pos] = value
     
     def to_list(self) -> List[str]:
         """Convert to list representation."""
-        return self._squares.copy()
+        return list(self.as_tuple())
+    
+    def as_tuple(self) -> Tuple[str, ...]:
+        """Convert to an immutable tuple, for serializers that only read it."""
+        return _squares_from_bits(self.x_bits, self.o_bits)
     
     def is_full(self) -> bool:
         """Check if board is full."""
-        return "" not in self._squares
+        return (self.x_bits | self.o_bits) == FULL_MASK
     
     def check_winner(self) -> Optional[str]:
         """Check if there's a winner."""
-        return Board.check_winner_from_list(self._squares)
+        return _winner_from_bits(self.x_bits, self.o_bits)
+    
+    def __eq__(self, other: object) -> bool:
+        """Boards are equal when they have the same squares."""
+        if not isinstance(other, Board):
+            return NotImplemented
+        return self.x_bits == other.x_bits and self.o_bits == other.o_bits
+    
+    def position_key(self) -> int:
+        """Return an exact 18-bit key for the current position.
+        
+        Board is mutable and so not hashable; use this snapshot as the
+        dict or set key instead, e.g. for a transposition table.
+        """
+        return self.x_bits | self.o_bits << 9
     
     @staticmethod
     def check_winner_from_list(board_as_list: List[str]) -> Optional[str]:
         """Check if there's a winner from a list representation of a board."""
-        lines = [
-            [0, 1, 2], [3, 4, 5], [6, 7, 8],  # Rows
-            [0, 3, 6], [1, 4, 7], [2, 5, 8],  # Columns
-            [0, 4, 8], [2, 4, 6]  # Diagonals
-        ]
-        
-        for line in lines:
-            if (board_as_list[line[0]] and board_as_list[line[0]] != "T" and
-                board_as_list[line[0]] == board_as_list[line[1]] == board_as_list[line[2]]):
-                return board_as_list[line[0]]
-        return None
+        return _winner_from_squares(tuple(board_as_list))
 
 class MetaBoard:
     """
     Represents the meta-board in Ultimate Tic-Tac-Toe, tracking the state of the 9 larger boards.
     Each position can be empty (""), won by a player ("X"/"O"), or tied ("T").
-    This is a read-only view computed from the actual board states.
+    This is a read-only view computed from the actual board states. After a
+    board is changed, call mark_dirty so only that board is re-evaluated.
     """
     
+    __slots__ = (
+        "_boards", "_x_bits", "_o_bits", "_tie_bits", "_completed", "_dirty", "_tuple"
+    )
+    
     def __init__(self, boards: List[Board]):
         """
         Initialize a meta-board from a list of Board objects.
@@ -65,23 +189,77 @@ class MetaBoard:
         """
         if len(boards) != 9:
             raise ValueError("MetaBoard must have exactly 9 boards")
-            
-        # Compute the state from the boards
-        self._state = ["" for _ in range(9)]
-        for i, board in enumerate(boards):
-            winner = board.check_winner()
-            if winner:
-                self._state[i] = winner
-            elif board.is_full():
-                self._state[i] = "T"
+        
+        self._boards = boards
+        # One bit per board for each outcome, computed lazily from the boards
+        # whose bit is set in the dirty mask
+        self._x_bits = self._o_bits = self._tie_bits = 0
+        # Bit i is set when board i is won or tied
+        self._completed = 0
+        self._dirty = FULL_MASK
+        self._tuple = None
+    
+    def mark_dirty(self, board_index: int) -> None:
+        """
+        Flag a board as changed so its outcome is recomputed on next access.
+        
+        Args:
+            board_index: Index of the board that changed (0-8)
+        """
+        self._dirty |= 1 << board_index
+    
+    def _refresh(self) -> None:
+        """Recompute the outcome of every board flagged as dirty."""
+        dirty = self._dirty
+        # Clear the stale outcomes of all dirty boards in one go, then OR the
+        # fresh ones back in and store the masks once at the end
+        x_acc = self._x_bits & ~dirty
+        o_acc = self._o_bits & ~dirty
+        tie_acc = self._tie_bits & ~dirty
+        boards = self._boards
+        while dirty:
+            bit = dirty & -dirty
+            board = boards[bit.bit_length() - 1]
+            x_bits, o_bits = board.x_bits, board.o_bits
+            # Same checks as check_winner/is_full, straight on the bitboards
+            if WINS[x_bits]:
+                x_acc |= bit
+            elif WINS[o_bits]:
+                o_acc |= bit
+            elif (x_bits | o_bits) == FULL_MASK:
+                tie_acc |= bit
+            dirty ^= bit
+        self._x_bits = x_acc
+        self._o_bits = o_acc
+        self._tie_bits = tie_acc
+        self._completed = x_acc | o_acc | tie_acc
+        self._dirty = 0
+        self._tuple = None
     
     def get_winner(self) -> Optional[str]:
         """Return 'X', 'O' if there's a winner, None otherwise."""
-        return Board.check_winner_from_list(self._state)
+        if self._dirty:
+            self._refresh()
+        return _winner_from_bits(self._x_bits, self._o_bits)
     
     def is_full(self) -> bool:
         """Check if meta-board is full (no empty spaces)."""
-        return "" not in self._state
+        if self._dirty:
+            self._refresh()
+        return self._completed == FULL_MASK
+    
+    def get_outcome(self) -> Tuple[Optional[str], bool]:
+        """
+        Get the winner and fullness of the meta-board from a single refresh.
+        
+        Returns:
+            (winner, full): 'X', 'O' or None, and whether every board is
+                completed
+        """
+        if self._dirty:
+            self._refresh()
+        winner = _winner_from_bits(self._x_bits, self._o_bits)
+        return winner, self._completed == FULL_MASK
     
     def is_board_playable(self, board_index: int) -> bool:
         """
@@ -92,18 +270,112 @@ class MetaBoard:
         Returns:
             bool: True if board is empty (not won/tied)
         """
-        if not 0 <= board_index <= 8:
-            raise ValueError("Board index must be between 0 and 8")
-        return self._state[board_index] == ""
+        try:
+            bit = SQUARE_BITS[board_index]
+        except KeyError:
+            raise ValueError("Board index must be between 0 and 8") from None
+        if self._dirty:
+            self._refresh()
+        return not self._completed & bit
+    
+    def get_next_board(self, last_position: int) -> Optional[int]:
+        """
+        Get the board the next player is sent to.
+        
+        Args:
+            last_position: Position (0-8) of the move just played
+        Returns:
+            The board index matching the position, or None if that board is
+            completed and the next player may play anywhere
+        """
+        if self._dirty:
+            self._refresh()
+        return None if self._completed >> last_position & 1 else last_position
     
     def to_list(self) -> List[str]:
         """Return list representation for API responses."""
-        return self._state.copy()
+        return list(self.as_tuple())
+    
+    def as_tuple(self) -> Tuple[str, ...]:
+        """Return an immutable tuple representation, cached until a board changes."""
+        if self._dirty:
+            self._refresh()
+        if self._tuple is None:
+            x_bits, o_bits, tie_bits = self._x_bits, self._o_bits, self._tie_bits
+            self._tuple = tuple(
+                "X" if x_bits & bit else
+                "O" if o_bits & bit else
+                "T" if tie_bits & bit else ""
+                for bit in BITS
+            )
+        return self._tuple
     
     def to_json(self) -> str:
         """Return JSON string representation for database storage."""
-        return json.dumps(self._state)
+        return orjson.dumps(self.as_tuple()).decode()
     
     def __str__(self) -> str:
         """Human-readable string representation."""
-        return f"MetaBoard({self._state})"
\ No newline at end of file
+        return f"MetaBoard({self.to_list()})"
+
+def get_boards_from_json(boards_json: str) -> List[Board]:
+    """
+    Parse the stored JSON representation of the 9 boards.
+    
+    Args:
+        boards_json: JSON array of 9 lists of 9 squares
+    Returns:
+        List of 9 Board objects
+    """
+    return [Board(squares) for squares in orjson.loads(boards_json)]
+
+def boards_to_json(boards: List[Board]) -> str:
+    """
+    Serialize the 9 boards to their stored JSON representation.
+    
+    Args:
+        boards: List of 9 Board objects
+    Returns:
+        JSON array of 9 lists of 9 squares
+    """
+    return orjson.dumps([board.as_tuple() for board in boards]).decode()
+
+def get_boards_from_bytes(data: bytes) -> List[Board]:
+    """
+    Unpack the stored binary representation of the 9 boards.
+    
+    Args:
+        data: 36 bytes in the BOARDS_STRUCT layout
+    Returns:
+        List of 9 Board objects
+    """
+    bits = BOARDS_STRUCT.unpack(data)
+    return [Board.from_bits(bits[i], bits[i + 1]) for i in range(0, 18, 2)]
+
+def boards_to_bytes(boards: List[Board]) -> bytes:
+    """
+    Pack the 9 boards into their stored binary representation.
+    
+    Args:
+        boards: List of 9 Board objects
+    Returns:
+        36 bytes in the BOARDS_STRUCT layout
+    """
+    return BOARDS_STRUCT.pack(
+        *[bits for board in boards for bits in (board.x_bits, board.o_bits)]
+    )
+
+def set_board_in_bytes(data: bytes, board_index: int, board: Board) -> bytes:
+    """
+    Replace a single board in the stored binary representation.
+    
+    Args:
+        data: 36 bytes in the BOARDS_STRUCT layout
+        board_index: Index of the board to replace (0-8)
+        board: The board's new state
+    Returns:
+        36 bytes with only that board's pair rewritten
+    """
+    start = board_index * BOARD_STRUCT.size
+    end = start + BOARD_STRUCT.size
+    return data[:start] + BOARD_STRUCT.pack(board.x_bits, board.o_bits) + data[end:]
\ No newline at end of file
@@ -1,37 +1,54 @@
 # This is a new file
-from typing import List
-import os
+import functools
 import logging
+import os
+from dataclasses import dataclass
+from typing import Optional, Tuple
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# The known frontend URL is always allowed, alongside local development
+DEFAULT_ORIGINS: Tuple[str, ...] = (
+    "http://localhost:5173",
+    "https://superttt-hbr1.onrender.com",
+)
+
+@dataclass(frozen=True, slots=True)
 class Config:
-    # Production flag
-    IS_PRODUCTION = os.environ.get("IS_PRODUCTION", "false").lower() == "true"
-    logger.info(f"Running in {'PRODUCTION' if IS_PRODUCTION else 'DEVELOPMENT'} mode")
+    """Application settings, resolved once from the environment."""
+    IS_PRODUCTION: bool
+    FRONTEND_URL: str
+    BACKEND_DOMAIN: Optional[str]
+    ALLOWED_ORIGINS: Tuple[str, ...]
+    HOST: str
+    PORT: int
 
-    # Get frontend URL directly from environment variable
-    FRONTEND_URL = os.environ.get("FRONTEND_URL", "http://localhost:5173")
-    logger.info(f"FRONTEND_URL set to: {FRONTEND_URL}")
-    
-    # Get backend domain for cookie setting
-    BACKEND_DOMAIN = os.environ.get("BACKEND_DOMAIN", "localhost" if not IS_PRODUCTION else None)
-    logger.info(f"BACKEND_DOMAIN set to: {BACKEND_DOMAIN}")
-    
-    # Allow the frontend URL and localhost for development
-    ALLOWED_ORIGINS: List[str] = [
-        FRONTEND_URL,
-        "http://localhost:5173",
-        "https://superttt-hbr1.onrender.com"  # Always include the known frontend URL
-    ]
-    
-    # Log allowed origins
-    logger.info(f"ALLOWED_ORIGINS: {ALLOWED_ORIGINS}")
+@functools.lru_cache(maxsize=1)
+def _load_config() -> Config:
+    """Read each environment variable exactly once and build the Config."""
+    env = os.environ
+    is_production = env.get("IS_PRODUCTION", "false").lower() == "true"
+    frontend_url = env.get("FRONTEND_URL", "http://localhost:5173")
+    return Config(
+        IS_PRODUCTION=is_production,
+        FRONTEND_URL=frontend_url,
+        # Backend domain for cookie setting
+        BACKEND_DOMAIN=env.get(
+            "BACKEND_DOMAIN", None if is_production else "localhost"
+        ),
+        # Deduplicated, since FRONTEND_URL is often one of the defaults
+        ALLOWED_ORIGINS=tuple(dict.fromkeys((frontend_url,) + DEFAULT_ORIGINS)),
+        HOST="0.0.0.0",  # Listen on all interfaces
+        PORT=int(env.get("PORT", "8000")),
+    )
 
-    # Server host and port
-    HOST: str = "0.0.0.0"  # Listen on all interfaces
-    PORT: int = int(os.environ.get("PORT", "8000"))
+config = _load_config()
 
-config = Config() 
\ No newline at end of file
+def log_config() -> None:
+    """Log the resolved settings, once logging has been configured."""
+    logger.info(
+        "Running in %s mode", "PRODUCTION" if config.IS_PRODUCTION else "DEVELOPMENT"
+    )
+    logger.info("FRONTEND_URL set to: %s", config.FRONTEND_URL)
+    logger.info("BACKEND_DOMAIN set to: %s", config.BACKEND_DOMAIN)
+    logger.info("ALLOWED_ORIGINS: %s", config.ALLOWED_ORIGINS)
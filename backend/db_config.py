@@ -23,8 +23,13 @@ if config.IS_PRODUCTION:
 else:
     DB_PATH = os.path.join(os.path.dirname(__file__), "tictactoe.db")
 
-logger.info(f"Running in {'PRODUCTION' if config.IS_PRODUCTION else 'DEVELOPMENT'} environment")
-logger.info(f"Using database at: {DB_PATH}")
+def log_db_config() -> None:
+    """Log which database is in use, once logging has been configured."""
+    logger.info(
+        "Running in %s environment",
+        "PRODUCTION" if config.IS_PRODUCTION else "DEVELOPMENT",
+    )
+    logger.info("Using database at: %s", DB_PATH)
 
 # Make sure the directory exists in production
 if config.IS_PRODUCTION and not os.path.exists(os.path.dirname(DB_PATH)):
@@ -1,11 +1,17 @@
-from fastapi import FastAPI, HTTPException, Response, Request
-from fastapi.middleware.cors import CORSMiddleware
-import logging
 import datetime
+import logging
 from datetime import timedelta
+from threading import Lock
+
+from cachetools import TTLCache
+
+from fastapi import FastAPI, HTTPException, Response, Request
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 
-from config import config
-from models import initialize_db, Player, Game
+from config import config, log_config
+from db_config import log_db_config
+from models import db, initialize_db
 from schemas import (
     MatchmakingRequest, MatchmakingResponse, GameResponse,
     SignupRequest, LoginRequest, ProfileUpdateRequest, StatsResponse
@@ -13,22 +19,26 @@ from schemas import (
 from services import GameService, ProfileService
 from matchmaking import MatchmakingService
 
-# Configure logging
+# Configure logging, then log the settings resolved at import
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
+log_config()
+log_db_config()
 
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
 
 # Log CORS configuration
-logger.info(f"Setting up CORS with allow_origins: {config.ALLOWED_ORIGINS}")
+logger.info("Setting up CORS with allow_origins: %s", config.ALLOWED_ORIGINS)
 
 # Enable CORS
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=config.ALLOWED_ORIGINS,
+    # Checked with `in` on every request
+    allow_origins=frozenset(config.ALLOWED_ORIGINS),
     allow_credentials=True,
-    allow_methods=["*"],
+    allow_methods=["GET", "POST"],  # The only methods the API routes use
     allow_headers=["*"],
+    max_age=7200,  # Let browsers reuse a preflight for 2 hours (Chromium's cap)
 )
 
 # Initialize database
@@ -49,11 +59,15 @@ def set_player_id_cookie(response: Response, player_id: str) -> None:
 
 # Auth endpoints
 @app.post("/auth/signup")
+@db.connection_context()
 def signup(request: SignupRequest, response: Response) -> dict:
     # Check if username or email already exists
-    if ProfileService.check_username_exists(request.username):
+    username_taken, email_taken = ProfileService.check_conflicts(
+        request.username, request.email
+    )
+    if username_taken:
         raise HTTPException(status_code=400, detail="Username already exists")
-    if ProfileService.check_email_exists(request.email):
+    if email_taken:
         raise HTTPException(status_code=400, detail="Email already exists")
 
     # Create new player profile
@@ -70,16 +84,17 @@ def signup(request: SignupRequest, response: Response) -> dict:
     return {"id": player.id}
 
 @app.post("/auth/login")
+@db.connection_context()
 def login(request: Request, request_data: LoginRequest, response: Response):
-    player = ProfileService.get_profile_by_email(request_data.email)
-    if not player:
+    player_id = ProfileService.get_player_id_by_email(request_data.email)
+    if not player_id:
         raise HTTPException(status_code=404, detail="Email not found")
     
-    set_player_id_cookie(response, player.id)
-    return {"player_id": player.id}
+    set_player_id_cookie(response, player_id)
+    return {"player_id": player_id}
 
 @app.post("/auth/logout")
-def logout(response: Response):
+async def logout(response: Response):
     response.delete_cookie(
         key="playerId",
         httponly=True,
@@ -91,36 +106,37 @@ def logout(response: Response):
     return {"message": "Logged out successfully"}
 
 @app.get("/profile/me")
+@db.connection_context()
 def get_current_profile(request: Request):
     player_id = request.cookies.get("playerId")
     if not player_id:
         raise HTTPException(status_code=401, detail="Not logged in")
     
-    player = ProfileService.get_profile(player_id)
+    player = ProfileService.get_profile_dict(player_id)
     if not player:
         raise HTTPException(status_code=404, detail="Player not found")
     
-    return player.to_dict()
+    return player
 
 @app.get("/profile/{player_id}")
+@db.connection_context()
 def get_profile(player_id: str):
-    player = ProfileService.get_profile(player_id)
+    player = ProfileService.get_profile_dict(player_id)
     if not player:
         raise HTTPException(status_code=404, detail="Player not found")
-    return player.to_dict()
+    return player
 
 @app.post("/profile/{player_id}")
+@db.connection_context()
 def update_profile(player_id: str, request: ProfileUpdateRequest):
-    # Check if email/username changes would conflict with existing users
-    if request.email:
-        existing_email = ProfileService.check_email_exists(request.email)
-        if existing_email and request.email != ProfileService.get_profile(player_id).email:
-            raise HTTPException(status_code=400, detail="Email already registered")
-    
-    if request.username:
-        existing_username = ProfileService.check_username_exists(request.username)
-        if existing_username and request.username != ProfileService.get_profile(player_id).username:
-            raise HTTPException(status_code=400, detail="Username already taken")
+    # Check if email/username changes would conflict with other users
+    username_taken, email_taken = ProfileService.check_conflicts(
+        request.username, request.email, exclude_id=player_id
+    )
+    if email_taken:
+        raise HTTPException(status_code=400, detail="Email already registered")
+    if username_taken:
+        raise HTTPException(status_code=400, detail="Username already taken")
     
     # Update profile with provided data
     player = ProfileService.update_profile(
@@ -139,45 +155,66 @@ def update_profile(player_id: str, request: ProfileUpdateRequest):
     
     return player.to_dict()
 
-# Stats endpoint
-@app.get("/stats")
-def get_stats() -> StatsResponse:
+# Stats are polled by every client, so recompute them at most every few seconds
+STATS_TTL = 5
+STATS_CACHE = TTLCache(maxsize=1, ttl=STATS_TTL)
+# Held while the stats are recomputed, so a burst of requests arriving as
+# the cache expires runs the query once instead of once per request
+STATS_LOCK = Lock()
+
+@db.connection_context()
+def compute_stats() -> StatsResponse:
+    """Count recent games and active players."""
     # Get timestamps for our time windows
     now = datetime.datetime.now(datetime.timezone.utc)
     last_24h = now - timedelta(days=1)
     last_7d = now - timedelta(days=7)
     
-    # Count games played in last 24 hours
-    games_today = Game.select().where(
-        Game.created_at >= last_24h
-    ).count()
-    
-    # Count unique players who played in last 7 days
-    active_players = (Player
-        .select()
-        .join(Game, on=((Player.id == Game.player_x) | (Player.id == Game.player_o)))
-        .where(Game.created_at >= last_7d)
-        .group_by(Player.id)
-        .count())
+    # Count games played in the last 24 hours and unique players who played
+    # in the last 7 days in a single round-trip
+    games_today, active_players = db.execute_sql("""
+        WITH recent AS (
+            SELECT player_x_id, player_o_id FROM game WHERE created_at >= ?
+        )
+        SELECT
+            (SELECT COUNT(*) FROM game WHERE created_at >= ?),
+            (SELECT COUNT(DISTINCT pid) FROM (
+                SELECT player_x_id AS pid FROM recent
+                UNION ALL
+                SELECT player_o_id FROM recent
+            ))
+    """, (last_7d, last_24h)).fetchone()
     
     return StatsResponse(
         games_today=games_today,
         players_online=active_players
     )
 
+# Stats endpoint
+@app.get("/stats")
+def get_stats() -> StatsResponse:
+    with STATS_LOCK:
+        stats = STATS_CACHE.get('stats')
+        if stats is None:
+            stats = STATS_CACHE['stats'] = compute_stats()
+    return stats
+
 @app.get("/")
-def read_root():
+async def read_root():
     return {"message": "Ultimate Tic-Tac-Toe API"}
 
 @app.get("/games/{game_id}")
+@db.connection_context()
 def get_game(game_id: str):
-    game = GameService.get_game(game_id)
-    if not game:
+    game_json = GameService.get_game_json(game_id)
+    if not game_json:
         raise HTTPException(status_code=404, detail="Game not found")
-    return game.to_dict()
+    # Already encoded, so skip FastAPI's response serialization
+    return Response(content=game_json, media_type="application/json")
 
 # Matchmaking endpoints
 @app.post("/matchmaking/join")
+@db.connection_context()
 def join_matchmaking(request: MatchmakingRequest) -> MatchmakingResponse:
     """Join the matchmaking queue"""
     if not MatchmakingService.add_player(request.player_id):
@@ -185,6 +222,7 @@ def join_matchmaking(request: MatchmakingRequest) -> MatchmakingResponse:
     return MatchmakingResponse(status="waiting")
 
 @app.post("/matchmaking/ping")
+@db.connection_context()
 def ping_matchmaking(request: MatchmakingRequest) -> MatchmakingResponse:
     """Ping to check matchmaking status and keep player in queue"""
     # Update player's presence
@@ -214,39 +252,46 @@ def ping_matchmaking(request: MatchmakingRequest) -> MatchmakingResponse:
         return MatchmakingResponse(status="waiting")
 
 @app.post("/matchmaking/cancel")
-def cancel_matchmaking(request: MatchmakingRequest) -> MatchmakingResponse:
+async def cancel_matchmaking(request: MatchmakingRequest) -> MatchmakingResponse:
     """Cancel matchmaking for a player"""
     if MatchmakingService.remove_player(request.player_id):
         return MatchmakingResponse(status="cancelled")
     raise HTTPException(status_code=400, detail="Player not in matchmaking")
 
-# Game action endpoints
-@app.post("/games/{game_id}/move/{board_index}/{position}")
+# Game action endpoints. The payload comes straight from Game.to_dict, so it
+# is returned as an ORJSONResponse: GameResponse is only declared for the docs,
+# and FastAPI skips validating and re-encoding what we built ourselves.
+@app.post("/games/{game_id}/move/{board_index}/{position}", response_model=GameResponse)
+@db.connection_context()
 def make_move(game_id: str, board_index: int, position: int, player_id: str):
     game, error = GameService.make_move(game_id, board_index, position, player_id)
     if error:
         raise HTTPException(status_code=400, detail=error)
     if not game:
         raise HTTPException(status_code=404, detail="Game not found")
-    return game.to_dict()
+    return ORJSONResponse(game.to_dict())
 
-@app.post("/games/{game_id}/resign")
+@app.post("/games/{game_id}/resign", response_model=GameResponse)
+@db.connection_context()
 def resign_game(game_id: str, player_id: str):
     game = GameService.resign_game(game_id, player_id)
     if not game:
         raise HTTPException(status_code=404, detail="Game not found")
-    return game.to_dict()
+    return ORJSONResponse(game.to_dict())
 
-@app.post("/games/{game_id}/ready")
-def ready_game(game_id: str, player_id: str) -> GameResponse:
+@app.post("/games/{game_id}/ready", response_model=GameResponse)
+@db.connection_context()
+def ready_game(game_id: str, player_id: str):
     """Signal that player X is ready to start the game"""
     game = GameService.get_game(game_id)
     if not game:
         raise HTTPException(status_code=404, detail="Game not found")
     
     # Only player X can signal ready
-    if game.player_x.id != player_id:
-        logging.error(f"Only player X can signal ready: {game.player_x.id} != {player_id}")
+    if game.player_x_id != player_id:
+        logging.error(
+            "Only player X can signal ready: %s != %s", game.player_x_id, player_id
+        )
         raise HTTPException(status_code=400, detail="Only player X can signal ready")
     
     # Start the game by setting the initial last_move_time
@@ -254,4 +299,4 @@ def ready_game(game_id: str, player_id: str) -> GameResponse:
     game.started = True
     game.save()
     
-    return GameResponse(**game.to_dict()) 
\ No newline at end of file
+    return ORJSONResponse(game.to_dict()) 
\ No newline at end of file
@@ -8,6 +8,13 @@ from models import Game, Player
 from services import ProfileService, GameService
 
 class MatchmakingService:
+    """
+    In-memory matchmaking queue and pending matches.
+    
+    The state lives in this process, so the API must run as a single worker
+    process; players queued in different workers would never be matched.
+    """
+    
     # TTL of 30 seconds for waiting players and matches
     CACHE_TTL = 30
     # Thread lock for synchronization
@@ -15,11 +22,15 @@ class MatchmakingService:
     # TTL cache for waiting players
     waiting_players = TTLCache(maxsize=1000, ttl=CACHE_TTL)
     # TTL cache for matched games
-    matched_games = TTLCache(maxsize=1000, ttl=CACHE_TTL)  # player_id -> (game_id, opponent_name, accepted)
+    matched_games = TTLCache(maxsize=1000, ttl=CACHE_TTL)  # player_id -> (game_id, opponent_id, opponent_name, accepted)
     
     @staticmethod
     def add_player(player_id: str) -> bool:
         """Add a player to the waiting list"""
+        # Repeated joins are common and need no database lookup
+        if player_id in MatchmakingService.waiting_players:
+            return True
+        
         player = ProfileService.get_profile(player_id)
         if not player:
             return False
@@ -29,9 +40,8 @@ class MatchmakingService:
             if player_id in MatchmakingService.waiting_players:
                 return True
             # Clear any previous matched game
-            if player_id in MatchmakingService.matched_games:
-                del MatchmakingService.matched_games[player_id]
-            logging.info(f"Adding player {player_id} to waiting list")
+            MatchmakingService.matched_games.pop(player_id, None)
+            logging.info("Adding player %s to waiting list", player_id)
             MatchmakingService.waiting_players[player_id] = player
         return True
     
@@ -39,36 +49,33 @@ class MatchmakingService:
     def remove_player(player_id: str) -> bool:
         """Remove a player from the waiting list and matched games"""
         with MatchmakingService.lock:
-            was_waiting = player_id in MatchmakingService.waiting_players
-            was_matched = player_id in MatchmakingService.matched_games
+            was_waiting = MatchmakingService.waiting_players.pop(player_id, None) is not None
+            match = MatchmakingService.matched_games.pop(player_id, None)
             
-            if player_id in MatchmakingService.waiting_players:
-                del MatchmakingService.waiting_players[player_id]
-            if player_id in MatchmakingService.matched_games:
+            if match is not None:
                 # Get the game info to clean up the other player's match
-                game_id, _, _ = MatchmakingService.matched_games[player_id]
-                # Find and remove the other player's match
-                for other_id, (other_game_id, _, _) in list(MatchmakingService.matched_games.items()):
-                    if other_game_id == game_id and other_id != player_id:
-                        del MatchmakingService.matched_games[other_id]
-                        break
-                del MatchmakingService.matched_games[player_id]
+                game_id, opponent_id, _, _ = match
+                # Remove the other player's match if it is still for this game
+                other = MatchmakingService.matched_games.get(opponent_id)
+                if other is not None and other[0] == game_id:
+                    del MatchmakingService.matched_games[opponent_id]
                 
-            return was_waiting or was_matched
+            return was_waiting or match is not None
     
     @staticmethod
     def update_ping(player_id: str) -> bool:
         """Update the player's presence in the cache (refreshes TTL)"""
         with MatchmakingService.lock:
-            if player_id in MatchmakingService.waiting_players:
-                player = MatchmakingService.waiting_players[player_id]
+            player = MatchmakingService.waiting_players.get(player_id)
+            if player is not None:
                 # Re-add to refresh TTL
                 MatchmakingService.waiting_players[player_id] = player
                 return True
-            elif player_id in MatchmakingService.matched_games:
+            match = MatchmakingService.matched_games.get(player_id)
+            if match is not None:
                 # Refresh TTL for matched game and mark as accepted
-                game_id, opponent_name, _ = MatchmakingService.matched_games[player_id]
-                MatchmakingService.matched_games[player_id] = (game_id, opponent_name, True)
+                game_id, opponent_id, opponent_name, _ = match
+                MatchmakingService.matched_games[player_id] = (game_id, opponent_id, opponent_name, True)
                 return True
         return False
     
@@ -76,7 +83,7 @@ class MatchmakingService:
     def create_game(player1: Player, player2: Player) -> Game:
         """Create a new game with randomly assigned X and O players"""
         # Randomly assign X and O
-        if random.random() < 0.5:
+        if random.getrandbits(1):
             player_x, player_o = player1, player2
         else:
             player_x, player_o = player2, player1
@@ -86,74 +93,101 @@ class MatchmakingService:
     @staticmethod
     def find_match(player_id: str) -> Tuple[Optional[Game], Optional[str], Optional[str], Optional[bool]]:
         """Find a match for the player. Returns (game, error_message, opponent_name, match_accepted)"""
+        # Database work happens outside the lock, so one slow query doesn't
+        # hold up matchmaking for every other player
         with MatchmakingService.lock:
             # First check if player has a matched game
-            if player_id in MatchmakingService.matched_games:
-                game_id, opponent_name, accepted = MatchmakingService.matched_games[player_id]
+            match = MatchmakingService.matched_games.get(player_id)
+            if match is not None:
+                game_id, opponent_id, opponent_name, accepted = match
                 
-                # Check if both players have accepted
-                both_accepted = accepted
+                # Check if both players have accepted, unless the game is
+                # still being created
+                both_accepted = accepted and game_id is not None
                 if both_accepted:
-                    for other_id, (other_game_id, _, other_accepted) in MatchmakingService.matched_games.items():
-                        if other_game_id == game_id and other_id != player_id:
-                            both_accepted = both_accepted and other_accepted
-                            break
+                    other = MatchmakingService.matched_games.get(opponent_id)
+                    if other is not None and other[0] == game_id:
+                        both_accepted = other[3]
                 
-                if both_accepted:
-                    # Both players have accepted, clean up and start the game
-                    logging.info(f"Both players have accepted, cleaning up and starting game {game_id}")
-                    del MatchmakingService.matched_games[player_id]
-                    game = Game.get(Game.id == game_id)
-                    if not game:
-                        logging.error(f"Game {game_id} not found after both players have accepted")
-                        return None, "Game not found", None, None
-                    return game, None, opponent_name, True
-                else:
+                if not both_accepted:
                     # Still waiting for other player to accept
                     return None, None, opponent_name, False
-            
-            # Check if player is still in waiting list
-            if player_id not in MatchmakingService.waiting_players:
-                return None, "Player not in waiting list", None, None
                 
-            player = MatchmakingService.waiting_players[player_id]
-            # Refresh TTL
-            MatchmakingService.waiting_players[player_id] = player
-            
-            # If there's only one player (this one), no match yet
-            if len(MatchmakingService.waiting_players) <= 1:
-                return None, None, None, None
-            
-            # Find another player
-            for other_id, other_player in list(MatchmakingService.waiting_players.items()):
-                if other_id != player_id:
-                    try:
-                        # Create the game
-                        game = MatchmakingService.create_game(player, other_player)
-                        logging.info(f"Created game {game.id} between {player.username} and {other_player.username}")
-                        
-                        # Store the game ID and opponent names for both players
-                        MatchmakingService.matched_games[player_id] = (game.id, other_player.username, False)
-                        MatchmakingService.matched_games[other_id] = (game.id, player.username, False)
-                        
-                        # Remove both players from waiting list
-                        del MatchmakingService.waiting_players[player_id]
-                        del MatchmakingService.waiting_players[other_id]
-                        
-                        return None, None, other_player.username, False
-                    except Exception as e:
-                        return None, f"Error creating game: {str(e)}", None, None
-            
-            return None, None, None, None 
+                # Both players have accepted, clean up and start the game
+                logging.info("Both players have accepted, cleaning up and starting game %s", game_id)
+                del MatchmakingService.matched_games[player_id]
+            else:
+                # Check if player is still in waiting list
+                player = MatchmakingService.waiting_players.get(player_id)
+                if player is None:
+                    return None, "Player not in waiting list", None, None
+                    
+                # Refresh TTL
+                MatchmakingService.waiting_players[player_id] = player
+                
+                # If there's only one player (this one), no match yet
+                if len(MatchmakingService.waiting_players) <= 1:
+                    return None, None, None, None
+                
+                # Take the longest waiting other player. The cache is kept in
+                # expiry order and was just purged by the refresh above, so at
+                # most two live entries are looked at
+                other_id = next(
+                    (other_id for other_id in MatchmakingService.waiting_players if other_id != player_id),
+                    None
+                )
+                if other_id is None:
+                    return None, None, None, None
+                other_player = MatchmakingService.waiting_players[other_id]
+                
+                # Reserve both players with a match that has no game yet
+                del MatchmakingService.waiting_players[player_id]
+                del MatchmakingService.waiting_players[other_id]
+                MatchmakingService.matched_games[player_id] = (None, other_id, other_player.username, False)
+                MatchmakingService.matched_games[other_id] = (None, player_id, player.username, False)
+        
+        if match is not None:
+            try:
+                return Game.get(Game.id == game_id), None, opponent_name, True
+            except Game.DoesNotExist:
+                logging.error("Game %s not found after both players have accepted", game_id)
+                return None, "Game not found", None, None
+        
+        try:
+            # Create the game
+            game = MatchmakingService.create_game(player, other_player)
+        except Exception as e:
+            with MatchmakingService.lock:
+                # Put both players back in the waiting list, unless they left
+                for waiting_id, waiting_player in ((player_id, player), (other_id, other_player)):
+                    reserved = MatchmakingService.matched_games.get(waiting_id)
+                    if reserved is not None and reserved[0] is None:
+                        del MatchmakingService.matched_games[waiting_id]
+                        MatchmakingService.waiting_players[waiting_id] = waiting_player
+            return None, f"Error creating game: {str(e)}", None, None
+        logging.info("Created game %s between %s and %s", game.id, player.username, other_player.username)
+        
+        with MatchmakingService.lock:
+            # Store the game ID for both players, keeping any acceptance that
+            # arrived while it was being created. A player who cancelled in
+            # the meantime has no reservation left and is skipped.
+            for matched_id, opponent_id, opponent_name in (
+                (player_id, other_id, other_player.username),
+                (other_id, player_id, player.username)
+            ):
+                reserved = MatchmakingService.matched_games.get(matched_id)
+                if reserved is not None and reserved[0] is None and reserved[1] == opponent_id:
+                    MatchmakingService.matched_games[matched_id] = (game.id, opponent_id, opponent_name, reserved[3])
+        
+        return None, None, other_player.username, False
 
     @staticmethod
     def is_player_in_queue(player_id: str) -> bool:
         """Check if a player is in the waiting queue."""
-        MatchmakingService.waiting_players.expire()
+        # Membership already ignores expired entries, without purging them
         return player_id in MatchmakingService.waiting_players
 
     @staticmethod
     def has_pending_match(player_id: str) -> bool:
         """Check if a player has a pending match."""
-        MatchmakingService.matched_games.expire()
         return player_id in MatchmakingService.matched_games 
\ No newline at end of file
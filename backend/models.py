@@ -1,17 +1,34 @@
 import datetime
-import json
-import shortuuid
+import secrets
 from peewee import *
+from playhouse.migrate import SqliteMigrator, migrate
+from playhouse.pool import PooledSqliteDatabase
 from db_config import DB_PATH
-from board_logic import MetaBoard, Board
+from board_logic import (
+    MetaBoard, Board, boards_to_bytes, boards_to_json, get_boards_from_bytes,
+    get_boards_from_json, set_board_in_bytes
+)
 from typing import List
 import sqlite3
 
-# Initialize database with datetime adapter
-db = SqliteDatabase(DB_PATH, pragmas={
-    'foreign_keys': 1,  # Enable foreign key support
-    'journal_mode': 'wal'  # Write-Ahead Logging for better concurrency
-}, detect_types=sqlite3.PARSE_DECLTYPES)  # Enable datetime type detection
+# Initialize database with datetime adapter. Connections are pooled so each
+# request reuses an already open and configured connection.
+db = PooledSqliteDatabase(
+    DB_PATH,
+    max_connections=40,  # Matches the default size of the request threadpool
+    stale_timeout=300,  # Recycle connections idle for 5 minutes
+    check_same_thread=False,  # Pooled connections are handed between threads
+    pragmas={
+        'foreign_keys': 1,  # Enable foreign key support
+        'journal_mode': 'wal',  # Write-Ahead Logging for better concurrency
+        'synchronous': 'normal',  # Safe with WAL, no fsync on every commit
+        'mmap_size': 256 * 1024 * 1024,  # Read pages via mmap instead of pread
+        'temp_store': 'memory',  # Keep temp tables and indices in memory
+        'cache_size': -64 * 1024,  # 64MB page cache (negative means KiB)
+        'busy_timeout': 5000  # Wait up to 5s for a lock instead of failing
+    },
+    detect_types=sqlite3.PARSE_DECLTYPES  # Enable datetime type detection
+)
 
 class BaseModel(Model):
     class Meta:
@@ -19,7 +36,7 @@ class BaseModel(Model):
 
 class Player(BaseModel):
     """Player model representing a user of the game."""
-    id = CharField(max_length=22, primary_key=True)  # shortuuid is always 22 chars
+    id = CharField(max_length=22, primary_key=True)  # token_urlsafe(16) is always 22 chars
     username = CharField(max_length=50, unique=True)
     email = CharField(max_length=255, unique=True)
     first_name = CharField(max_length=50, null=True)
@@ -37,7 +54,7 @@ class Player(BaseModel):
     def save(self, *args, **kwargs):
         """Override save to ensure ID is set for new players."""
         if not self.id:
-            self.id = shortuuid.uuid()
+            self.id = secrets.token_urlsafe(16)
         return super().save(*args, **kwargs)
     
     def to_dict(self):
@@ -61,7 +78,7 @@ class Player(BaseModel):
 
 class Game(BaseModel):
     """Game model representing a single game of Ultimate Tic-Tac-Toe."""
-    id = CharField(max_length=22, primary_key=True)  # shortuuid is always 22 chars
+    id = CharField(max_length=22, primary_key=True)  # token_urlsafe(16) is always 22 chars
     current_player = CharField(default="X")
     next_board = IntegerField(null=True)
     winner = CharField(null=True)
@@ -84,22 +101,80 @@ class Game(BaseModel):
     player_x_elo_change = IntegerField(null=True)  # ELO change for player X
     player_o_elo_change = IntegerField(null=True)  # ELO change for player O
     
-    # JSON fields - meta_board is now computed dynamically from boards
-    boards = TextField(default=json.dumps([[""]*9 for _ in range(9)]))
+    # The 9 boards packed as bitboards (see board_logic.BOARDS_STRUCT) - the
+    # meta board is computed dynamically from them
+    board_bits = BlobField(default=boards_to_bytes([Board() for _ in range(9)]))
+    
+    # Bumped in SQL by every UPDATE, so (id, revision) names one stored state
+    revision = IntegerField(default=0)
+
+    class Meta:
+        # Covers the /stats query, which filters on created_at and reads only
+        # the player ids, so it never has to visit the table rows
+        indexes = (
+            (('created_at', 'player_x', 'player_o'), False),
+        )
+        # Only write changed columns, so saving the clock can't overwrite a
+        # move that another request saved in the meantime
+        only_save_dirty = True
 
     def save(self, *args, **kwargs):
-        """Override save to ensure ID is set for new games."""
+        """Override save to set the ID of new games and bump the revision of saved ones."""
         if not self.id:
-            self.id = shortuuid.uuid()
+            self.id = secrets.token_urlsafe(16)
+        elif not kwargs.get('force_insert'):
+            # Nothing changed, so keep the revision and any payload cached for it
+            if not self.dirty_fields:
+                return False
+            return self._update_changed(Game.id == self.id)
         return super().save(*args, **kwargs)
 
+    def save_move(self, previous_bits: bytes) -> bool:
+        """
+        Save the changed fields only if the stored boards are still unchanged.
+        
+        Args:
+            previous_bits: board_bits as read before the move was applied
+        Returns:
+            bool: False if another move was saved first, in which case
+                nothing is written
+        """
+        return bool(self._update_changed(
+            (Game.id == self.id) & (Game.board_bits == previous_bits)
+        ))
+
+    def _update_changed(self, where) -> int:
+        """
+        Write the changed fields and bump the revision in a single UPDATE.
+        
+        Args:
+            where: Condition selecting the row to update
+        Returns:
+            int: Number of rows updated, 0 if the condition matched none
+        """
+        data = {field: self.__data__[field.name] for field in self.dirty_fields}
+        data[Game.revision] = Game.revision + 1
+        rows = Game.update(data).where(where).execute()
+        if rows:
+            self._dirty.clear()
+            # Only the database knows the new revision; drop the old one rather
+            # than keep a wrong value on this instance
+            self.__data__.pop('revision', None)
+        return rows
+
     def get_time_remaining(self, player):
         """Get remaining time for a player in seconds."""
         time_used = self.player_x_time_used if player == 'X' else self.player_o_time_used
         return max(0, self.TOTAL_TIME_ALLOWED - time_used)
     
-    def update_time_used(self):
-        """Update time used by current player based on last move time."""
+    def update_time_used(self, save: bool = True):
+        """
+        Update time used by current player based on last move time.
+        
+        Args:
+            save: Write the clock right away; pass False when the caller
+                saves it together with other changes
+        """
         now = datetime.datetime.now()
         elapsed = int((now - self.last_move_time).total_seconds())
         
@@ -109,17 +184,30 @@ class Game(BaseModel):
             self.player_o_time_used += elapsed
             
         self.last_move_time = now
-        self.save()  # Save the updated time
+        if save:
+            self.save()  # Save the updated time
         return self.get_time_remaining(self.current_player)
     
+    @property
+    def boards(self) -> str:
+        """The boards as a JSON array of 9 lists of 9 squares."""
+        return boards_to_json(self.get_boards())
+    
+    @boards.setter
+    def boards(self, boards_json: str) -> None:
+        self.set_boards(get_boards_from_json(boards_json))
+    
     def get_boards(self) -> List[Board]:
         """Get the list of Board objects."""
-        boards_data = json.loads(self.boards)
-        return [Board(squares) for squares in boards_data]
+        return get_boards_from_bytes(self.board_bits)
     
     def set_boards(self, boards: List[Board]) -> None:
         """Save the list of Board objects."""
-        self.boards = json.dumps([board.to_list() for board in boards])
+        self.board_bits = boards_to_bytes(boards)
+    
+    def set_board(self, board_index: int, board: Board) -> None:
+        """Save a single Board object, leaving the others untouched."""
+        self.board_bits = set_board_in_bytes(self.board_bits, board_index, board)
     
     def get_meta_board(self) -> MetaBoard:
         """Get the current meta board state."""
@@ -127,31 +215,61 @@ class Game(BaseModel):
     
     def to_dict(self):
         """Convert model to dictionary for API response."""
-        meta = self.get_meta_board()
         boards = self.get_boards()
+        meta = MetaBoard(boards)
         return {
             'id': self.id,
-            'meta_board': meta.to_list(),
-            'boards': [board.to_list() for board in boards],
+            'meta_board': meta.as_tuple(),
+            'boards': [board.as_tuple() for board in boards],
             'current_player': self.current_player,
             'next_board': self.next_board,
             'winner': self.winner,
             'started': self.started,
             'game_over': self.game_over,
             'player_x': {
-                'id': self.player_x.id if self.player_x else None,  
+                'id': self.player_x_id,
                 'time_remaining': self.get_time_remaining('X'),
                 'elo_change': self.player_x_elo_change
             },
             'player_o': {
-                'id': self.player_o.id if self.player_o else None,  
+                'id': self.player_o_id,
                 'time_remaining': self.get_time_remaining('O'),
                 'elo_change': self.player_o_elo_change
             }
         }
 
+def migrate_db(database: Database = db) -> None:
+    """
+    Bring a database created by an older version up to the current schema.
+    
+    create_tables never alters an existing table, so columns added since are
+    created here, and data in replaced columns is converted.
+    
+    Args:
+        database: Database to migrate, with the game table already created
+    """
+    columns = {column.name for column in database.get_columns('game')}
+    migrator = SqliteMigrator(database)
+    with database.atomic():
+        if 'board_bits' not in columns:
+            # The boards used to be stored as JSON in a boards TEXT column
+            migrate(migrator.add_column('game', 'board_bits', Game.board_bits))
+            if 'boards' in columns:
+                rows = database.execute_sql('SELECT id, boards FROM game').fetchall()
+                for game_id, boards_json in rows:
+                    database.execute_sql(
+                        'UPDATE game SET board_bits = ? WHERE id = ?',
+                        (boards_to_bytes(get_boards_from_json(boards_json)), game_id)
+                    )
+                migrate(migrator.drop_column('game', 'boards'))
+        if 'revision' not in columns:
+            migrate(migrator.add_column('game', 'revision', Game.revision))
+
 def initialize_db():
-    """Create tables if they don't exist."""
+    """Create tables if they don't exist and migrate older schemas."""
     db.connect()
     db.create_tables([Player, Game])
-    db.close() 
\ No newline at end of file
+    migrate_db(db)
+    # Returns the connection to the pool, already opened and configured, so
+    # the first request doesn't pay for it
+    db.close()
\ No newline at end of file
@@ -1,6 +1,12 @@
-import json
-from typing import Optional, Tuple
 import math
+import operator
+from functools import reduce
+from itertools import count
+from threading import Lock
+from typing import Optional, Tuple
+
+import orjson
+from cachetools import LRUCache, TTLCache
 
 from models import Game, Player
 from board_logic import MetaBoard
@@ -15,6 +21,37 @@ LEVEL_ELO_RATINGS = {
     PlayerLevel.ADVANCED: 900
 }
 
+# Returned when another move on the same game was saved first
+STALE_MOVE_ERROR = "Game was updated by another move, please retry"
+
+# Player counter incremented for each game result
+RESULT_FIELDS = {
+    'win': Player.wins,
+    'loss': Player.losses,
+    'draw': Player.draws
+}
+
+# Encoded game payloads keyed by (game_id, revision); a new revision is a new
+# key, so entries never go stale and old ones simply age out
+GAME_CACHE = LRUCache(maxsize=4096)
+GAME_CACHE_LOCK = Lock()
+
+# Profile payloads keyed by player_id. Entries are dropped whenever this
+# process updates the player; the TTL bounds staleness from other workers.
+PROFILE_TTL = 60
+PROFILE_CACHE = TTLCache(maxsize=4096, ttl=PROFILE_TTL)
+PROFILE_CACHE_LOCK = Lock()
+# Last invalidation per player, drawn from a shared counter so a value is never
+# reused. A profile read is only cached if this didn't change while it ran.
+PROFILE_GENERATIONS = LRUCache(maxsize=4096)
+PROFILE_GENERATION_COUNTER = count(1)
+
+# Moves on the same game run one at a time in this process instead of racing
+# each other into STALE_MOVE_ERROR. Games share a fixed set of striped locks,
+# so there is nothing to create per game or clean up when one ends.
+GAME_LOCK_STRIPES = 64
+GAME_LOCKS = tuple(Lock() for _ in range(GAME_LOCK_STRIPES))
+
 class PlayerService:
     @staticmethod
     def get_player(player_id: str) -> Optional[Player]:
@@ -68,26 +105,34 @@ class PlayerService:
         # Calculate ELO change
         elo_change = PlayerService.calculate_elo_change(player.elo, opponent.elo, result_value)
         
-        # Update player's ELO
+        # Update player's ELO in place, so a concurrent update isn't lost
+        Player.update(elo=Player.elo + elo_change).where(
+            Player.id == player_id
+        ).execute()
+        ProfileService.invalidate_profile(player_id)
         player.elo += elo_change
-        player.save()
         
         return player, elo_change
     
     @staticmethod
-    def update_player_stats(player_id: str, result: str) -> Player:
-        """Update player stats after a game."""
-        player = PlayerService.get_player(player_id)
-        
-        if result == 'win':
-            player.wins += 1
-        elif result == 'loss':
-            player.losses += 1
-        elif result == 'draw':
-            player.draws += 1
+    def update_player_stats(player_id: str, result: str) -> bool:
+        """
+        Update player stats after a game with a single atomic UPDATE.
         
-        player.save()
-        return player
+        Args:
+            player_id: ID of the player
+            result: 'win', 'loss', or 'draw'
+            
+        Returns:
+            True if the player's stats were updated
+        """
+        field = RESULT_FIELDS.get(result)
+        if field is None:
+            return False
+        query = Player.update({field: field + 1}).where(Player.id == player_id)
+        updated = query.execute() > 0
+        ProfileService.invalidate_profile(player_id)
+        return updated
     
 class ProfileService:
     @staticmethod
@@ -98,6 +143,30 @@ class ProfileService:
         except Player.DoesNotExist:
             return None
     
+    @staticmethod
+    def get_profile_dict(player_id: str) -> Optional[dict]:
+        """Get a player's profile payload, cached for up to PROFILE_TTL seconds."""
+        with PROFILE_CACHE_LOCK:
+            data = PROFILE_CACHE.get(player_id)
+            generation = PROFILE_GENERATIONS.get(player_id)
+        if data is None:
+            player = ProfileService.get_profile(player_id)
+            if not player:
+                return None
+            data = player.to_dict()
+            with PROFILE_CACHE_LOCK:
+                # Skip the store if the player was invalidated during the read
+                if PROFILE_GENERATIONS.get(player_id) == generation:
+                    PROFILE_CACHE[player_id] = data
+        return data
+    
+    @staticmethod
+    def invalidate_profile(player_id: str) -> None:
+        """Drop a player's cached profile after it changed."""
+        with PROFILE_CACHE_LOCK:
+            PROFILE_CACHE.pop(player_id, None)
+            PROFILE_GENERATIONS[player_id] = next(PROFILE_GENERATION_COUNTER)
+    
     @staticmethod
     def get_profile_by_email(email: str) -> Optional[Player]:
         """Get a player's profile by email."""
@@ -106,6 +175,11 @@ class ProfileService:
         except Player.DoesNotExist:
             return None
     
+    @staticmethod
+    def get_player_id_by_email(email: str) -> Optional[str]:
+        """Get the ID of the player with this email, without loading the profile."""
+        return Player.select(Player.id).where(Player.email == email).scalar()
+    
     @staticmethod
     def create_profile(username: str, email: str, level: str, timezone: Optional[str] = None, country: Optional[str] = None) -> Player:
         """Create a new player profile."""
@@ -127,21 +201,53 @@ class ProfileService:
                 if hasattr(player, field) and value is not None:
                     setattr(player, field, value)
             player.save()
+            ProfileService.invalidate_profile(player_id)
             return player
         except Player.DoesNotExist:
             return None
     
     @staticmethod
-    def check_username_exists(username: str) -> bool:
-        """Check if a username is already taken."""
-        return Player.select().where(Player.username == username).exists()
-    
-    @staticmethod
-    def check_email_exists(email: str) -> bool:
-        """Check if an email is already registered."""
-        return Player.select().where(Player.email == email).exists()
+    def check_conflicts(
+        username: Optional[str], email: Optional[str], exclude_id: Optional[str] = None
+    ) -> Tuple[bool, bool]:
+        """
+        Check in a single query whether a username and/or email are taken.
+        
+        Args:
+            username: Username to check, or None to skip it
+            email: Email to check, or None to skip it
+            exclude_id: ID of a player whose own username and email don't count
+            
+        Returns:
+            Tuple of (username_taken, email_taken)
+        """
+        conditions = []
+        if username:
+            conditions.append(Player.username == username)
+        if email:
+            conditions.append(Player.email == email)
+        if not conditions:
+            return False, False
+        
+        query = Player.select(Player.username, Player.email).where(
+            reduce(operator.or_, conditions)
+        )
+        if exclude_id is not None:
+            query = query.where(Player.id != exclude_id)
+        
+        # Both columns are unique, so at most one row matches each
+        username_taken = email_taken = False
+        for row_username, row_email in query.limit(2).tuples():
+            username_taken = username_taken or row_username == username
+            email_taken = email_taken or row_email == email
+        return username_taken, email_taken
 
 class GameService:
+    @staticmethod
+    def _lock_for(game_id: str) -> Lock:
+        """Get the lock serializing writes to a game."""
+        return GAME_LOCKS[hash(game_id) % GAME_LOCK_STRIPES]
+    
     @staticmethod
     def create_game(player_x: Player, player_o: Player) -> Game:
         """Create a new game with pre-assigned X and O players"""
@@ -159,24 +265,46 @@ class GameService:
         except Game.DoesNotExist:
             return None
     
+    @staticmethod
+    def get_game_json(game_id: str) -> Optional[bytes]:
+        """Get a game's JSON payload, only loading the full row when it changed."""
+        revision = Game.select(Game.revision).where(Game.id == game_id).scalar()
+        if revision is None:
+            return None
+        with GAME_CACHE_LOCK:
+            data = GAME_CACHE.get((game_id, revision))
+        if data is None:
+            game = GameService.get_game(game_id)
+            if not game:
+                return None
+            data = orjson.dumps(game.to_dict())
+            # Keyed by the revision read with the row, in case it moved on since
+            with GAME_CACHE_LOCK:
+                GAME_CACHE[(game_id, game.revision)] = data
+        return data
+    
     @staticmethod
     def resign_game(game_id: str, player_id: str) -> Optional[Game]:
         """Resign from a game."""
+        with GameService._lock_for(game_id):
+            return GameService._resign_game(game_id, player_id)
+    
+    @staticmethod
+    def _resign_game(game_id: str, player_id: str) -> Optional[Game]:
         try:
             game = Game.get(Game.id == game_id)
             
-            if (not game.player_x or game.player_x.id != player_id) and \
-               (not game.player_o or game.player_o.id != player_id):
+            if player_id not in (game.player_x_id, game.player_o_id):
                 return None
             
             # Set winner to the other player
-            if game.player_x and game.player_x.id == player_id:
+            if game.player_x_id == player_id:
                 game.winner = 'O'
-                winner_id = game.player_o.id if game.player_o else None
+                winner_id = game.player_o_id
                 loser_id = player_id
             else:
                 game.winner = 'X'
-                winner_id = game.player_x.id if game.player_x else None
+                winner_id = game.player_x_id
                 loser_id = player_id
                 
             game.game_over = True
@@ -208,16 +336,28 @@ class GameService:
     @staticmethod
     def make_move(game_id: str, board_index: int, position: int, player_id: str) -> Tuple[Optional[Game], Optional[str]]:
         """Make a move in the game. Returns (game, error_message)."""
+        with GameService._lock_for(game_id):
+            return GameService._make_move(game_id, board_index, position, player_id)
+    
+    @staticmethod
+    def _make_move(
+        game_id: str, board_index: int, position: int, player_id: str
+    ) -> Tuple[Optional[Game], Optional[str]]:
         try:
             game = Game.get(Game.id == game_id)
             
             # Verify it's the player's turn
-            current_player = game.player_x if game.current_player == 'X' else game.player_o
-            if not current_player or current_player.id != player_id:
+            # Compare foreign key ids directly, without loading the players
+            current_player_id = (
+                game.player_x_id if game.current_player == 'X' else game.player_o_id
+            )
+            if not current_player_id or current_player_id != player_id:
                 return None, "Not your turn"
                 
             # Update time used and check if player ran out of time
-            time_remaining = game.update_time_used()
+            # The clock is saved along with the move (or the forfeit) below, in
+            # the same UPDATE; a rejected move leaves the stored clock running
+            time_remaining = game.update_time_used(save=False)
             if time_remaining <= 0:
                 # Player ran out of time, they lose
                 game.winner = 'O' if game.current_player == 'X' else 'X'
@@ -225,25 +365,25 @@ class GameService:
                 game.save()
                 
                 # Update player stats
-                if game.winner == 'X' and game.player_x and game.player_o:
-                    PlayerService.update_player_stats(game.player_x.id, 'win')
-                    PlayerService.update_player_stats(game.player_o.id, 'loss')
+                if game.winner == 'X' and game.player_x_id and game.player_o_id:
+                    PlayerService.update_player_stats(game.player_x_id, 'win')
+                    PlayerService.update_player_stats(game.player_o_id, 'loss')
                     
                     # Update ELO ratings
-                    player_x, x_elo_change = PlayerService.update_player_elo(game.player_x.id, game.player_o.id, 'win')
-                    player_o, o_elo_change = PlayerService.update_player_elo(game.player_o.id, game.player_x.id, 'loss')
+                    player_x, x_elo_change = PlayerService.update_player_elo(game.player_x_id, game.player_o_id, 'win')
+                    player_o, o_elo_change = PlayerService.update_player_elo(game.player_o_id, game.player_x_id, 'loss')
                     
                     # Store ELO changes
                     game.player_x_elo_change = x_elo_change
                     game.player_o_elo_change = o_elo_change
                     game.save()
-                elif game.player_x and game.player_o:
-                    PlayerService.update_player_stats(game.player_o.id, 'win')
-                    PlayerService.update_player_stats(game.player_x.id, 'loss')
+                elif game.player_x_id and game.player_o_id:
+                    PlayerService.update_player_stats(game.player_o_id, 'win')
+                    PlayerService.update_player_stats(game.player_x_id, 'loss')
                     
                     # Update ELO ratings
-                    player_o, o_elo_change = PlayerService.update_player_elo(game.player_o.id, game.player_x.id, 'win')
-                    player_x, x_elo_change = PlayerService.update_player_elo(game.player_x.id, game.player_o.id, 'loss')
+                    player_o, o_elo_change = PlayerService.update_player_elo(game.player_o_id, game.player_x_id, 'win')
+                    player_x, x_elo_change = PlayerService.update_player_elo(game.player_x_id, game.player_o_id, 'loss')
                     
                     # Store ELO changes
                     game.player_x_elo_change = x_elo_change
@@ -259,50 +399,52 @@ class GameService:
             # Get boards as proper Board objects
             boards = game.get_boards()
             
-            # Get meta state as proper MetaBoard object
-            meta = game.get_meta_board()
+            # Get meta state as proper MetaBoard object over the same boards
+            meta = MetaBoard(boards)
             
             # Verify the move is valid
             if not meta.is_board_playable(board_index):
                 return None, "Board already completed"
                 
-            if boards[board_index].get(position) != "":
+            if not boards[board_index].is_empty(position):
                 return None, "Position already taken"
             
-            # Make the move
+            # Make the move, keeping the boards it was validated against
+            previous_bits = game.board_bits
             boards[board_index].set(position, game.current_player)
             
-            # Save boards
-            game.set_boards(boards)
+            # Save the one board that changed
+            game.set_board(board_index, boards[board_index])
             
             # Check for winner using new meta state
-            meta = game.get_meta_board()  # Recompute after move
-            meta_winner = meta.get_winner()
+            meta.mark_dirty(board_index)  # Only the played board can change
+            meta_winner, meta_full = meta.get_outcome()
             if meta_winner:
                 game.winner = meta_winner
                 game.game_over = True
-                game.save()
+                if not game.save_move(previous_bits):
+                    return None, STALE_MOVE_ERROR
                 
                 # Update player stats
-                if game.winner == 'X' and game.player_x and game.player_o:
-                    PlayerService.update_player_stats(game.player_x.id, 'win')
-                    PlayerService.update_player_stats(game.player_o.id, 'loss')
+                if game.winner == 'X' and game.player_x_id and game.player_o_id:
+                    PlayerService.update_player_stats(game.player_x_id, 'win')
+                    PlayerService.update_player_stats(game.player_o_id, 'loss')
                     
                     # Update ELO ratings
-                    player_x, x_elo_change = PlayerService.update_player_elo(game.player_x.id, game.player_o.id, 'win')
-                    player_o, o_elo_change = PlayerService.update_player_elo(game.player_o.id, game.player_x.id, 'loss')
+                    player_x, x_elo_change = PlayerService.update_player_elo(game.player_x_id, game.player_o_id, 'win')
+                    player_o, o_elo_change = PlayerService.update_player_elo(game.player_o_id, game.player_x_id, 'loss')
                     
                     # Store ELO changes
                     game.player_x_elo_change = x_elo_change
                     game.player_o_elo_change = o_elo_change
                     game.save()
-                elif game.player_x and game.player_o:
-                    PlayerService.update_player_stats(game.player_o.id, 'win')
-                    PlayerService.update_player_stats(game.player_x.id, 'loss')
+                elif game.player_x_id and game.player_o_id:
+                    PlayerService.update_player_stats(game.player_o_id, 'win')
+                    PlayerService.update_player_stats(game.player_x_id, 'loss')
                     
                     # Update ELO ratings
-                    player_o, o_elo_change = PlayerService.update_player_elo(game.player_o.id, game.player_x.id, 'win')
-                    player_x, x_elo_change = PlayerService.update_player_elo(game.player_x.id, game.player_o.id, 'loss')
+                    player_o, o_elo_change = PlayerService.update_player_elo(game.player_o_id, game.player_x_id, 'win')
+                    player_x, x_elo_change = PlayerService.update_player_elo(game.player_x_id, game.player_o_id, 'loss')
                     
                     # Store ELO changes
                     game.player_x_elo_change = x_elo_change
@@ -312,18 +454,19 @@ class GameService:
                 return game, None
                 
             # Check for draw
-            if meta.is_full():
+            if meta_full:
                 game.game_over = True
-                game.save()
+                if not game.save_move(previous_bits):
+                    return None, STALE_MOVE_ERROR
                 
                 # Update player stats for a draw
-                if game.player_x and game.player_o:
-                    PlayerService.update_player_stats(game.player_x.id, 'draw')
-                    PlayerService.update_player_stats(game.player_o.id, 'draw')
+                if game.player_x_id and game.player_o_id:
+                    PlayerService.update_player_stats(game.player_x_id, 'draw')
+                    PlayerService.update_player_stats(game.player_o_id, 'draw')
                     
                     # Update ELO ratings for a draw
-                    player_x, x_elo_change = PlayerService.update_player_elo(game.player_x.id, game.player_o.id, 'draw')
-                    player_o, o_elo_change = PlayerService.update_player_elo(game.player_o.id, game.player_x.id, 'draw')
+                    player_x, x_elo_change = PlayerService.update_player_elo(game.player_x_id, game.player_o_id, 'draw')
+                    player_o, o_elo_change = PlayerService.update_player_elo(game.player_o_id, game.player_x_id, 'draw')
                     
                     # Store ELO changes
                     game.player_x_elo_change = x_elo_change
@@ -333,15 +476,13 @@ class GameService:
                 return game, None
             
             # Set next board
-            if not meta.is_board_playable(position):
-                game.next_board = None
-            else:
-                game.next_board = position
+            game.next_board = meta.get_next_board(position)
             
             # Switch player
             game.current_player = "O" if game.current_player == "X" else "X"
             
-            game.save()
+            if not game.save_move(previous_bits):
+                return None, STALE_MOVE_ERROR
             return game, None
             
         except Game.DoesNotExist:
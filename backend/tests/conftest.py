@@ -51,6 +51,8 @@ def test_db():
     try:
         if not db.is_closed():
             db.close()
+        # Drop pooled connections too, so nothing keeps the database file open
+        db.close_all()
     except:
         pass
     
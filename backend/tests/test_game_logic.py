@@ -1,9 +1,11 @@
 import pytest
 import json
+import orjson
 from datetime import datetime, timedelta
 from freezegun import freeze_time
 from services import GameService
 from models import Game, Player
+from board_logic import Board
 
 @pytest.mark.game_logic
 class TestGameLogic:
@@ -80,6 +82,150 @@ class TestGameLogic:
         assert error == "Must play in the indicated board"
         assert game is None
 
+    def test_move_to_taken_position(self, sample_players):
+        """Test that moves to occupied squares are rejected."""
+        boards = [[""]*9 for _ in range(9)]
+        boards[4][4] = "O"
+
+        active_game = Game.create(
+            player_x=sample_players[0],
+            player_o=sample_players[1],
+            current_player="X",
+            next_board=4,
+            boards=json.dumps(boards)
+        )
+        self.start_game(active_game)
+
+        game, error = GameService.make_move(
+            active_game.id,
+            board_index=4,
+            position=4,
+            player_id=sample_players[0].id
+        )
+
+        assert error == "Position already taken"
+        assert game is None
+
+    def test_concurrent_move_not_lost(self, sample_players):
+        """Test that a move saved from stale state can't overwrite another move."""
+        active_game = Game.create(
+            player_x=sample_players[0],
+            player_o=sample_players[1],
+            current_player="X",
+            next_board=4
+        )
+        self.start_game(active_game)
+
+        # A second request that read the game before the first move landed
+        stale_game = Game.get(Game.id == active_game.id)
+        stale_bits = stale_game.board_bits
+
+        game, error = GameService.make_move(
+            active_game.id,
+            board_index=4,
+            position=0,
+            player_id=sample_players[0].id
+        )
+        assert error is None
+
+        boards = stale_game.get_boards()
+        boards[4].set(8, "X")
+        stale_game.set_board(4, boards[4])
+        assert not stale_game.save_move(stale_bits)
+
+        saved_boards = Game.get(Game.id == active_game.id).get_boards()
+        assert saved_boards[4].get(0) == "X"
+        assert saved_boards[4].get(8) == ""
+
+    def test_revision_bumped_only_on_change(self, sample_players):
+        """Test that saves bump the stored revision only when something changed."""
+        active_game = Game.create(
+            player_x=sample_players[0],
+            player_o=sample_players[1],
+            current_player="X"
+        )
+        self.start_game(active_game)
+        assert Game.get(Game.id == active_game.id).revision == 1
+        # The new value is only known to the database, so none is kept here
+        assert active_game.revision is None
+
+        assert not active_game.save()
+        assert Game.get(Game.id == active_game.id).revision == 1
+
+        active_game.winner = "X"
+        active_game.save()
+        assert Game.get(Game.id == active_game.id).revision == 2
+
+    def test_cached_game_dict_follows_revision(self, sample_players):
+        """Test that the cached game payload is replaced once the game changes."""
+        active_game = Game.create(
+            player_x=sample_players[0],
+            player_o=sample_players[1],
+            current_player="X",
+            next_board=4
+        )
+        self.start_game(active_game)
+
+        first = GameService.get_game_json(active_game.id)
+        assert GameService.get_game_json(active_game.id) is first
+        assert orjson.loads(first)['boards'][4][0] == ""
+
+        GameService.make_move(
+            active_game.id,
+            board_index=4,
+            position=0,
+            player_id=sample_players[0].id
+        )
+
+        second = orjson.loads(GameService.get_game_json(active_game.id))
+        assert second['boards'][4][0] == "X"
+        assert second['current_player'] == "O"
+        assert GameService.get_game_json("missing") is None
+
+    def test_clock_saved_with_move(self, sample_players):
+        """Test that the mover's clock is written along with the move."""
+        active_game = Game.create(
+            player_x=sample_players[0],
+            player_o=sample_players[1],
+            current_player="X",
+            next_board=4
+        )
+        self.start_game(active_game)
+        Game.update(last_move_time=datetime.now() - timedelta(seconds=10)).where(
+            Game.id == active_game.id
+        ).execute()
+
+        game, error = GameService.make_move(
+            active_game.id,
+            board_index=4,
+            position=0,
+            player_id=sample_players[0].id
+        )
+        assert error is None
+
+        saved_game = Game.get(Game.id == active_game.id)
+        assert saved_game.player_x_time_used == 10
+        assert saved_game.player_o_time_used == 0
+        assert saved_game.get_boards()[4].get(0) == "X"
+
+    def test_rejected_resign_keeps_game_lock(self, sample_players):
+        """Test that a rejected resign leaves the game serialized on the same lock."""
+        active_game = Game.create(
+            player_x=sample_players[0],
+            player_o=sample_players[1],
+            current_player="X"
+        )
+        self.start_game(active_game)
+        lock = GameService._lock_for(active_game.id)
+
+        assert GameService.resign_game(active_game.id, "nobody") is None
+        assert GameService._lock_for(active_game.id) is lock
+        assert not lock.locked()
+
+        game = GameService.resign_game(active_game.id, sample_players[0].id)
+        assert game.winner == "O"
+        assert GameService._lock_for(active_game.id) is lock
+
     @freeze_time("2024-01-01 12:00:00")
     def test_time_control_forfeit(self):
         """Test that a player forfeits when they exceed their time limit."""
@@ -202,4 +348,30 @@ class TestGameLogic:
         meta = game.get_meta_board()
         meta_state = meta.to_list()
         assert meta_state[1] == "T"  # Second board should now be tied
-        assert meta_state.count("T") == 2  # Should have two tied boards 
\ No newline at end of file
+        assert meta_state.count("T") == 2  # Should have two tied boards 
+    def test_check_winner_from_list(self):
+        """Test the list-based winner check, including repeated positions."""
+        assert Board.check_winner_from_list(["X", "X", "X"] + [""] * 6) == "X"
+        column = ["O", "", "", "O", "", "", "O", "", ""]
+        assert Board.check_winner_from_list(column) == "O"
+        # A tied square never counts towards a line
+        assert Board.check_winner_from_list(["T", "T", "T"] + [""] * 6) is None
+        assert Board.check_winner_from_list([""] * 9) is None
+        # A repeated position gives the same answer
+        assert Board.check_winner_from_list(column) == "O"
+
+    def test_board_equality(self):
+        """Test that boards compare equal by their squares."""
+        board = Board(["X", "", "O"] + [""] * 6)
+        assert board == Board(["X", "", "O"] + [""] * 6)
+        assert board != Board(["O", "", "X"] + [""] * 6)
+        assert board != board.to_list()
+        # Boards are mutable, so they aren't hashable; key on a snapshot
+        with pytest.raises(TypeError):
+            hash(board)
+        table = {board.position_key(): "seen"}
+        board.set(4, "X")
+        assert board.position_key() not in table
+        board.set(4, "")
+        assert table[board.position_key()] == "seen"
+        assert Board().position_key() == 0
@@ -33,6 +33,45 @@ class TestMatchmaking:
         assert not MatchmakingService.is_player_in_queue(sample_players[0].id)
         assert not MatchmakingService.is_player_in_queue(sample_players[1].id)
 
+    def test_match_longest_waiting_player(self, sample_players):
+        """Test that a new player is matched with whoever has waited longest."""
+        MatchmakingService.waiting_players.clear()
+        MatchmakingService.matched_games.clear()
+        
+        MatchmakingService.add_player(sample_players[0].id)
+        MatchmakingService.add_player(sample_players[1].id)
+        MatchmakingService.add_player(sample_players[2].id)
+        game, error, opponent_name, accepted = MatchmakingService.find_match(
+            sample_players[2].id
+        )
+        
+        assert error is None
+        assert opponent_name == "test_player_0"
+        assert MatchmakingService.is_player_in_queue(sample_players[1].id)
+        assert not MatchmakingService.is_player_in_queue(sample_players[2].id)
+
+    def test_ping_while_game_is_created(self, sample_players, monkeypatch):
+        """Test that the game is created outside the lock and early pings count."""
+        MatchmakingService.waiting_players.clear()
+        MatchmakingService.matched_games.clear()
+        create_game = MatchmakingService.create_game
+        
+        def create_game_with_ping(player1, player2):
+            # Would deadlock if find_match still held the lock here
+            assert MatchmakingService.update_ping(sample_players[1].id)
+            return create_game(player1, player2)
+        
+        monkeypatch.setattr(
+            MatchmakingService, "create_game", staticmethod(create_game_with_ping)
+        )
+        MatchmakingService.add_player(sample_players[0].id)
+        MatchmakingService.add_player(sample_players[1].id)
+        MatchmakingService.find_match(sample_players[0].id)
+        
+        game_id, _, _, accepted = MatchmakingService.matched_games[sample_players[1].id]
+        assert game_id is not None
+        assert accepted
+
     @freeze_time("2024-01-01 12:00:00")
     def test_match_acceptance_timeout(self, test_db):
         """Test that matches expire if not accepted in time."""
@@ -0,0 +1,77 @@
+import json
+
+import pytest
+from board_logic import get_boards_from_bytes
+from models import Game, Player, migrate_db
+from peewee import SqliteDatabase
+
+# Schema written by versions that stored the boards as JSON text
+OLD_SCHEMA = (
+    """CREATE TABLE "player" (
+        "id" VARCHAR(22) NOT NULL PRIMARY KEY, "username" VARCHAR(50) NOT NULL,
+        "email" VARCHAR(255) NOT NULL, "first_name" VARCHAR(50),
+        "last_name" VARCHAR(50), "wins" INTEGER NOT NULL, "losses" INTEGER NOT NULL,
+        "draws" INTEGER NOT NULL, "elo" INTEGER NOT NULL, "location" VARCHAR(100),
+        "country" VARCHAR(2), "timezone" VARCHAR(50), "created_at" DATETIME NOT NULL,
+        "last_active" DATETIME NOT NULL)""",
+    """CREATE TABLE "game" (
+        "id" VARCHAR(22) NOT NULL PRIMARY KEY, "current_player" VARCHAR(255) NOT NULL,
+        "next_board" INTEGER, "winner" VARCHAR(255), "started" INTEGER NOT NULL,
+        "game_over" INTEGER NOT NULL, "created_at" DATETIME NOT NULL,
+        "completed_at" DATETIME, "player_x_id" VARCHAR(22), "player_o_id" VARCHAR(22),
+        "last_move_time" DATETIME NOT NULL, "player_x_time_used" INTEGER NOT NULL,
+        "player_o_time_used" INTEGER NOT NULL, "player_x_elo_change" INTEGER,
+        "player_o_elo_change" INTEGER, "boards" TEXT NOT NULL,
+        FOREIGN KEY ("player_x_id") REFERENCES "player" ("id"),
+        FOREIGN KEY ("player_o_id") REFERENCES "player" ("id"))""",
+)
+
+@pytest.mark.integration
+class TestMigration:
+    def test_migrate_json_boards(self, tmp_path):
+        """Test that a database with the old boards column is upgraded in place."""
+        old_db = SqliteDatabase(str(tmp_path / "old.db"))
+        for statement in OLD_SCHEMA:
+            old_db.execute_sql(statement)
+
+        boards = [[""]*9 for _ in range(9)]
+        boards[4][4] = "X"
+        boards[0][8] = "O"
+        old_db.execute_sql(
+            """INSERT INTO game VALUES ('old-game', 'X', 0, NULL, 1, 0,
+            '2024-01-01T12:00:00', NULL, NULL, NULL, '2024-01-01T12:00:00',
+            5, 3, NULL, NULL, ?)""",
+            (json.dumps(boards),)
+        )
+
+        with old_db.bind_ctx([Player, Game]):
+            # What initialize_db does on startup
+            old_db.create_tables([Player, Game])
+            migrate_db(old_db)
+
+            columns = {column.name for column in old_db.get_columns('game')}
+            assert 'boards' not in columns
+
+            board_bits, x_time, o_time = old_db.execute_sql(
+                "SELECT board_bits, player_x_time_used, player_o_time_used FROM game"
+            ).fetchone()
+            migrated = [board.to_list() for board in get_boards_from_bytes(board_bits)]
+            assert migrated == boards
+            assert (x_time, o_time) == (5, 3)
+
+            game = Game.get(Game.id == 'old-game')
+            assert json.loads(game.boards) == boards
+            assert game.revision == 0
+
+            # Migrated games can be updated and new ones created alongside them
+            game.winner = "X"
+            game.save()
+            Game.create(current_player="X")
+            assert Game.select().count() == 2
+            assert Game.get(Game.id == 'old-game').revision == 1
+
+            # Running it again on an up-to-date database changes nothing
+            migrate_db(old_db)
+            row = old_db.execute_sql("SELECT board_bits FROM game").fetchone()
+            assert row[0] == board_bits
+        old_db.close()
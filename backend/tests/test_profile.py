@@ -0,0 +1,75 @@
+import pytest
+from models import Player
+from services import PlayerService, ProfileService
+
+
+@pytest.mark.auth
+class TestProfile:
+    def test_check_conflicts(self, sample_players):
+        """Test that username and email conflicts are found in one check."""
+        check = ProfileService.check_conflicts
+        assert check("test_player_0", "player1@test.com") == (True, True)
+        assert check("test_player_0", "new@test.com") == (True, False)
+        assert check("new_player", "player2@test.com") == (False, True)
+        assert check("new_player", "new@test.com") == (False, False)
+        assert check(None, None) == (False, False)
+
+    def test_check_conflicts_excludes_own_profile(self, sample_players):
+        """Test that a player's own username and email don't count as taken."""
+        player = sample_players[0]
+        assert ProfileService.check_conflicts(
+            player.username, player.email, exclude_id=player.id
+        ) == (False, False)
+        assert ProfileService.check_conflicts(
+            "test_player_1", None, exclude_id=player.id
+        ) == (True, False)
+
+    def test_get_player_id_by_email(self, sample_players):
+        """Test that login's email lookup returns just the player's ID."""
+        player_id = ProfileService.get_player_id_by_email("player1@test.com")
+        assert player_id == sample_players[1].id
+        assert ProfileService.get_player_id_by_email("missing@test.com") is None
+
+    def test_update_player_stats(self, sample_players):
+        """Test that game results increment the matching counter."""
+        player_id = sample_players[0].id
+        assert PlayerService.update_player_stats(player_id, 'win')
+        assert PlayerService.update_player_stats(player_id, 'win')
+        assert PlayerService.update_player_stats(player_id, 'draw')
+        assert not PlayerService.update_player_stats("missing", 'loss')
+
+        player = Player.get(Player.id == player_id)
+        assert (player.wins, player.losses, player.draws) == (2, 0, 1)
+
+    def test_cached_profile_invalidated_on_update(self, sample_players):
+        """Test that a cached profile is dropped when the player changes."""
+        player_id = sample_players[0].id
+        first = ProfileService.get_profile_dict(player_id)
+        assert ProfileService.get_profile_dict(player_id) is first
+
+        PlayerService.update_player_stats(player_id, 'win')
+        assert ProfileService.get_profile_dict(player_id)['stats']['wins'] == 1
+
+        ProfileService.update_profile(player_id, location="Berlin")
+        assert ProfileService.get_profile_dict(player_id)['location'] == "Berlin"
+        assert ProfileService.get_profile_dict("missing") is None
+
+    def test_profile_invalidated_during_read_not_cached(
+        self, sample_players, monkeypatch
+    ):
+        """Test that a read racing an invalidation doesn't cache stale data."""
+        player_id = sample_players[1].id
+        get_profile = ProfileService.get_profile
+
+        def read_then_update(pid):
+            player = get_profile(pid)
+            PlayerService.update_player_stats(pid, 'win')
+            return player
+
+        monkeypatch.setattr(
+            ProfileService, "get_profile", staticmethod(read_then_update)
+        )
+        assert ProfileService.get_profile_dict(player_id)['stats']['wins'] == 0
+
+        monkeypatch.setattr(ProfileService, "get_profile", staticmethod(get_profile))
+        assert ProfileService.get_profile_dict(player_id)['stats']['wins'] == 1